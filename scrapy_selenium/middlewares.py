@@ -1,20 +1,82 @@
 """This module contains the ``SeleniumMiddleware`` scrapy middleware"""
 
+from concurrent.futures import ThreadPoolExecutor
+import copy
+from functools import partial
 from importlib import import_module
+import logging
+import os
 import random
-import time
+import socket
+from urllib.parse import urlsplit
+import weakref
 import urllib3
 
 from scrapy import signals
 from scrapy.exceptions import NotConfigured
 from scrapy.http import HtmlResponse
 from selenium.webdriver.support.ui import WebDriverWait
+from twisted.internet.defer import DeferredList, DeferredQueue, DeferredSemaphore, succeed
+from twisted.internet.task import deferLater
+from twisted.internet.threads import deferToThreadPool
+from twisted.python.threadpool import ThreadPool
 
 from .http import SeleniumRequest
 
+logger = logging.getLogger(__name__)
+
+# sets all the ``[name, value]`` cookies given as argument on the current page
+# origin in a single command, the values are sent unchanged like the other drivers do
+SET_COOKIES_SCRIPT = '''
+for (const [name, value] of arguments[0]) {
+    document.cookie = name + '=' + value + '; path=/';
+}
+'''
+
+# clears the storages of the current page, ignoring the pages denying their access
+CLEAR_STORAGE_SCRIPT = '''
+try {
+    window.localStorage.clear();
+    window.sessionStorage.clear();
+} catch (e) {}
+'''
+
+# the values of the ``SELENIUM_PAGE_LOAD_STRATEGY`` setting
+PAGE_LOAD_STRATEGIES = ('normal', 'eager', 'none')
+
+# the storages of the visited origins the chrome driver clears on a soft reset, the
+# session storage is not a devtools storage type and is cleared by CLEAR_STORAGE_SCRIPT
+CLEARED_STORAGE_TYPES = ','.join([
+    'local_storage', 'indexeddb', 'websql', 'service_workers', 'cache_storage',
+])
+
+# the assets the chrome driver does not download when blocking them
+BLOCKED_ASSET_URLS = [
+    '*.png', '*.jpg', '*.jpeg', '*.gif', '*.webp', '*.woff', '*.woff2', '*.mp4', '*.css',
+]
+
+# the preferences preventing the firefox driver from downloading the assets
+BLOCKED_ASSET_PREFERENCES = {
+    'permissions.default.image': 2,
+    'gfx.downloadable_fonts.enabled': False,
+    'media.autoplay.default': 5,
+}
+
+
+def _origin(url):
+    """Return the ``scheme://netloc`` origin of the given url"""
+
+    parts = urlsplit(url)
+
+    return f'{parts.scheme}://{parts.netloc}'
+
+
 class SeleniumMiddleware:
     """Scrapy middleware handling the requests using selenium"""
 
+    # the ``WebDriver`` and ``Options`` classes of each driver name
+    _klass_cache = {}
+
     def __init__(
         self,
         driver_name,
@@ -26,6 +88,13 @@ class SeleniumMiddleware:
         driver_profile,
         concurrent_requests,
         concurrent_requests_per_domain,
+        pool_size=None,
+        user_data_dir=None,
+        hard_reset=False,
+        page_load_strategy='eager',
+        block_assets=False,
+        download_delay=0,
+        randomize_download_delay=False,
     ):
         """Initialize the selenium webdriver
 
@@ -45,71 +114,267 @@ class SeleniumMiddleware:
             The path of the executable binary of the browser
         command_executor: str
             Selenium remote server endpoint
+        concurrent_requests: int
+            The maximum number of concurrent requests performed by scrapy
+        concurrent_requests_per_domain: int
+            The maximum number of concurrent requests performed by scrapy on a single domain
+        pool_size: int
+            The number of drivers to keep in the pool, defaults to ``concurrent_requests``
+        user_data_dir: str
+            The directory where the locally installed drivers keep their profile and cache
+        hard_reset: bool
+            If True, ``driver.replace_driver`` restarts the driver instead of clearing its state
+        page_load_strategy: str
+            When the driver returns from loading a page: "normal", "eager" or "none"
+        block_assets: bool
+            If True, the driver does not download the images, fonts, media and stylesheets
+        download_delay: float
+            The number of seconds to wait before processing a request
+        randomize_download_delay: bool
+            If True, wait between 0.5 and 1.5 times ``download_delay``
         """
 
-        webdriver_base_path = f'selenium.webdriver.{driver_name}'
+        if driver_name not in self._klass_cache:
+            webdriver_base_path = f'selenium.webdriver.{driver_name}'
+
+            driver_klass_module = import_module(f'{webdriver_base_path}.webdriver')
+            driver_klass = getattr(driver_klass_module, 'WebDriver')
 
-        driver_klass_module = import_module(f'{webdriver_base_path}.webdriver')
-        driver_klass = getattr(driver_klass_module, 'WebDriver')
+            driver_options_module = import_module(f'{webdriver_base_path}.options')
+            driver_options_klass = getattr(driver_options_module, 'Options')
 
-        driver_options_module = import_module(f'{webdriver_base_path}.options')
-        driver_options_klass = getattr(driver_options_module, 'Options')
+            self._klass_cache[driver_name] = (driver_klass, driver_options_klass)
+
+        driver_klass, driver_options_klass = self._klass_cache[driver_name]
 
         driver_options = driver_options_klass()
+        # the selenium 3 options have no setter for the page load strategy
+        driver_options._caps['pageLoadStrategy'] = page_load_strategy
 
         if browser_executable_path:
             driver_options.binary_location = browser_executable_path
         for argument in driver_arguments:
             driver_options.add_argument(argument)
-        if driver_name == 'firefox':
-            for k, v in driver_preferences.items():
-                driver_options.set_preference(k, v)
 
-        self._command_executor = command_executor
-        self._driver_name = driver_name
-        self._driver_klass = driver_klass
+        self._options_key = f'{driver_name}_options'
         self._driver_kwargs = {
             'executable_path': driver_executable_path,
-            f'{driver_name}_options': driver_options,
+            self._options_key: driver_options,
         }
         if driver_name == 'firefox':
+            for k, v in driver_preferences.items():
+                driver_options.set_preference(k, v)
+            if user_data_dir is not None:
+                driver_options.set_preference('browser.cache.disk.enable', True)
+            if block_assets:
+                for k, v in BLOCKED_ASSET_PREFERENCES.items():
+                    driver_options.set_preference(k, v)
             if driver_profile is not None:
                 self._driver_kwargs['firefox_profile'] = driver_profile
 
-        self.replace_driver()
+        # the remote drivers are all built with the same capabilities
+        self._capabilities = driver_options.to_capabilities()
+
+        self._command_executor = command_executor
+        self._driver_name = driver_name
+        # only the locally installed chrome driver exposes the devtools protocol
+        self._supports_cdp = driver_name == 'chrome' and driver_executable_path is not None
+        self._add_cookies = (
+            self._add_cookies_with_cdp if self._supports_cdp else self._add_cookies_with_script
+        )
+        self._driver_klass = driver_klass
+        self._user_data_dir = user_data_dir
+        self._reset_driver = self.replace_driver if hard_reset else self.soft_reset
+        self._block_assets = block_assets
+
+        self._download_delay = download_delay
+        self._randomize_download_delay = randomize_download_delay
+        self._download_delay_bounds = (0.5 * download_delay, 1.5 * download_delay)
+        # without a delay the requests skip the wait step altogether
+        self._process_in_domain_slot = (
+            self._process_after_download_delay
+            if download_delay else
+            self._process_without_download_delay
+        )
+
+        # one semaphore per domain with requests being processed
+        self._concurrent_requests_per_domain = concurrent_requests_per_domain or 4
+        self._domain_semaphores = {}
+
+        self._pool_size = pool_size or concurrent_requests or 1
+
+        # imported once scrapy has installed the reactor of the TWISTED_REACTOR setting
+        from twisted.internet import reactor
+        self._reactor = reactor
 
-    def replace_driver(self):
-        if hasattr(self, 'driver'):
-            self.driver.delete_all_cookies()
-            self.driver.quit()
+        # the drivers do not share the reactor thread pool, used by the DNS resolver
+        self._threadpool = ThreadPool(0, self._pool_size, 'scrapy-selenium')
+        self._threadpool.start()
+        self._reactor.addSystemEventTrigger('during', 'shutdown', self._stop_threadpool)
+
+        # takes the screenshots while the page sources are retrieved
+        self._executor = ThreadPoolExecutor(max_workers=self._pool_size)
+
+        # the pool holds the slots of the idle drivers in ``self._drivers``, the
+        # slots exposed to the spiders are held until their driver is released
+        self._drivers = [None] * self._pool_size
+        self._held_slots = {}
+        self._pool = DeferredQueue()
+        try:
+            for slot in range(self._pool_size):
+                self._replace_driver(slot)
+                self._pool.put(slot)
+        except Exception:
+            # the browsers already started would outlive the failed middleware
+            self._quit_drivers()
+            raise
+
+    @property
+    def driver(self):
+        """The first driver of the pool"""
+
+        return self._drivers[0]
+
+    def _persistent_profile_kwargs(self, slot):
+        """Return the driver kwargs using the persistent profile of the given pool slot"""
+
+        # two browsers cannot share a profile, each slot has its own
+        profile_dir = os.path.join(self._user_data_dir, str(slot))
+        os.makedirs(profile_dir, exist_ok=True)
+
+        driver_options = copy.deepcopy(self._driver_kwargs[self._options_key])
+        if self._driver_name == 'chrome':
+            driver_options.add_argument(f'--user-data-dir={profile_dir}')
+            driver_options.add_argument(f'--disk-cache-dir={os.path.join(profile_dir, "cache")}')
+        elif self._driver_name == 'firefox':
+            driver_options.add_argument('-profile')
+            driver_options.add_argument(profile_dir)
+
+        return dict(self._driver_kwargs, **{self._options_key: driver_options})
+
+    def _build_driver(self, slot):
+        """Build a new selenium webdriver for the given pool slot"""
 
         # locally installed driver
         if self._driver_kwargs['executable_path'] is not None:
-            self.driver = self._driver_klass(**self._driver_kwargs)
-            self.driver.set_window_size(
-                random.uniform(1920 * 0.5, 1920),
-                random.uniform(1080 * 0.5, 1080),
-            )
-
-            # we replace the default PoolManager
-            self.driver.command_executor._conn.clear()
-            self.driver.command_executor._conn = urllib3.PoolManager(
-                timeout=self.driver.command_executor._timeout,
-                maxsize=1,
+            driver_kwargs = self._driver_kwargs
+            if self._user_data_dir is not None:
+                driver_kwargs = self._persistent_profile_kwargs(slot)
+
+            driver = self._driver_klass(**driver_kwargs)
+
+            width = int(random.uniform(1920 * 0.5, 1920))
+            height = int(random.uniform(1080 * 0.5, 1080))
+            # overriding the viewport does not resize the browser window
+            if self._supports_cdp:
+                driver.execute_cdp_cmd(
+                    'Emulation.setDeviceMetricsOverride',
+                    {'width': width, 'height': height, 'deviceScaleFactor': 1, 'mobile': False}
+                )
+            else:
+                driver.set_window_size(width, height)
+
+            # we replace the default PoolManager with one keeping the connections
+            # to the driver alive, so that every command does not open a new one.
+            # A driver sends at most two commands at once (the page source and the
+            # screenshot), and a connection dropped while idle is retried once.
+            driver.command_executor._conn.clear()
+            driver.command_executor._conn = urllib3.PoolManager(
+                timeout=driver.command_executor._timeout,
+                maxsize=2,
                 block=False,
+                retries=urllib3.Retry(total=1, connect=1, read=1, redirect=0),
+                socket_options=[
+                    (socket.IPPROTO_TCP, socket.TCP_NODELAY, 1),
+                    (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+                ],
             )
+
+            if self._supports_cdp and self._block_assets:
+                driver.execute_cdp_cmd('Network.enable', {})
+                driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': BLOCKED_ASSET_URLS})
         # remote driver
         elif self._command_executor is not None:
             from selenium import webdriver
-            capabilities = self._driver_kwargs[f'{self._driver_name_options}'].to_capabilities()
-            self.driver = webdriver.Remote(
+            driver = webdriver.Remote(
                 command_executor=self._command_executor,
-                desired_capabilities=capabilities
+                desired_capabilities=self._capabilities
             )
 
-        self.driver.replace_driver = self.replace_driver
+        return driver
+
+    def replace_driver(self, slot=0):
+        """Shutdown the driver of the given pool slot and replace it with a new one"""
+
+        return self._reset_slot(slot, self._replace_driver)
+
+    def soft_reset(self, slot=0):
+        """Clear the state of the driver of the given pool slot without restarting it"""
+
+        return self._reset_slot(slot, self._soft_reset)
 
-        return self.driver
+    def _reset_slot(self, slot, reset):
+        """Run the given reset on the driver of a slot held by a response or idle"""
+
+        if slot in self._held_slots:
+            return reset(slot)
+
+        if slot not in self._pool.pending:
+            raise RuntimeError(f'The driver of the slot {slot} is processing a request')
+
+        # an idle slot is taken out of the pool during the reset
+        self._pool.pending.remove(slot)
+        try:
+            return reset(slot)
+        finally:
+            self._pool.put(slot)
+
+    def _replace_driver(self, slot):
+        """Shutdown the driver of the given pool slot and replace it with a new one"""
+
+        if self._drivers[slot] is not None:
+            # keep the cookies of a persistent profile
+            if self._user_data_dir is None:
+                self._drivers[slot].delete_all_cookies()
+            self._drivers[slot].quit()
+            self._drivers[slot] = None
+
+        driver = self._build_driver(slot)
+        driver.replace_driver = partial(self._reset_driver, slot)
+        # a driver processes one request at a time, its wait is reused by every request
+        driver._cached_wait = WebDriverWait(driver, timeout=10)
+        # the origins whose storages are cleared on a soft reset
+        driver._visited_origins = set()
+        self._drivers[slot] = driver
+
+        return driver
+
+    def _soft_reset(self, slot):
+        """Clear the state of the driver of the given pool slot without restarting it"""
+
+        driver = self._drivers[slot]
+
+        # only the session storage of the current page can be cleared
+        driver.execute_script(CLEAR_STORAGE_SCRIPT)
+
+        # keep the cookies and cache of a persistent profile
+        if self._supports_cdp:
+            for origin in driver._visited_origins:
+                driver.execute_cdp_cmd(
+                    'Storage.clearDataForOrigin',
+                    {'origin': origin, 'storageTypes': CLEARED_STORAGE_TYPES}
+                )
+            if self._user_data_dir is None:
+                driver.execute_cdp_cmd('Network.clearBrowserCookies', {})
+                driver.execute_cdp_cmd('Network.clearBrowserCache', {})
+        elif self._user_data_dir is None:
+            # only the cookies of the current page can be cleared
+            driver.delete_all_cookies()
+
+        driver._visited_origins.clear()
+        driver.get('about:blank')
+
+        return driver
 
     @classmethod
     def from_crawler(cls, crawler):
@@ -119,11 +384,18 @@ class SeleniumMiddleware:
         driver_executable_path = crawler.settings.get('SELENIUM_DRIVER_EXECUTABLE_PATH')
         browser_executable_path = crawler.settings.get('SELENIUM_BROWSER_EXECUTABLE_PATH')
         command_executor = crawler.settings.get('SELENIUM_COMMAND_EXECUTOR')
-        driver_arguments = crawler.settings.get('SELENIUM_DRIVER_ARGUMENTS')
-        driver_preferences = crawler.settings.get('SELENIUM_DRIVER_PREFERENCES')
+        driver_arguments = crawler.settings.getlist('SELENIUM_DRIVER_ARGUMENTS')
+        driver_preferences = crawler.settings.getdict('SELENIUM_DRIVER_PREFERENCES')
         driver_profile = crawler.settings.get('SELENIUM_DRIVER_PROFILE')
         concurrent_requests = crawler.settings.getint('CONCURRENT_REQUESTS')
         concurrent_requests_per_domain = crawler.settings.getint('CONCURRENT_REQUESTS_PER_DOMAIN')
+        pool_size = crawler.settings.getint('SELENIUM_POOL_SIZE')
+        user_data_dir = crawler.settings.get('SELENIUM_USER_DATA_DIR')
+        hard_reset = crawler.settings.getbool('SELENIUM_HARD_RESET')
+        page_load_strategy = crawler.settings.get('SELENIUM_PAGE_LOAD_STRATEGY', 'eager')
+        block_assets = crawler.settings.getbool('SELENIUM_BLOCK_ASSETS')
+        download_delay = crawler.settings.getfloat('DOWNLOAD_DELAY')
+        randomize_download_delay = crawler.settings.getbool('RANDOMIZE_DOWNLOAD_DELAY')
 
         if driver_name is None:
             raise NotConfigured('SELENIUM_DRIVER_NAME must be set')
@@ -132,6 +404,14 @@ class SeleniumMiddleware:
             raise NotConfigured('Either SELENIUM_DRIVER_EXECUTABLE_PATH '
                                 'or SELENIUM_COMMAND_EXECUTOR must be set')
 
+        if page_load_strategy not in PAGE_LOAD_STRATEGIES:
+            raise NotConfigured('SELENIUM_PAGE_LOAD_STRATEGY must be one of '
+                                + ', '.join(PAGE_LOAD_STRATEGIES))
+
+        if user_data_dir is not None and driver_profile is not None:
+            raise NotConfigured('SELENIUM_USER_DATA_DIR and SELENIUM_DRIVER_PROFILE '
+                                'cannot be both set')
+
         middleware = cls(
             driver_name=driver_name,
             driver_executable_path=driver_executable_path,
@@ -142,6 +422,13 @@ class SeleniumMiddleware:
             driver_profile=driver_profile,
             concurrent_requests=concurrent_requests,
             concurrent_requests_per_domain=concurrent_requests_per_domain,
+            pool_size=pool_size,
+            user_data_dir=user_data_dir,
+            hard_reset=hard_reset,
+            page_load_strategy=page_load_strategy,
+            block_assets=block_assets,
+            download_delay=download_delay,
+            randomize_download_delay=randomize_download_delay,
         )
 
         crawler.signals.connect(middleware.spider_closed, signals.spider_closed)
@@ -154,47 +441,251 @@ class SeleniumMiddleware:
         if not isinstance(request, SeleniumRequest):
             return None
 
-        delay = spider.settings.getint('DOWNLOAD_DELAY')
-        randomize_delay = spider.settings.getbool('RANDOMIZE_DOWNLOAD_DELAY')
-        if delay:
-            if randomize_delay:
-                delay = random.uniform(0.5 * delay, 1.5 * delay)
-            time.sleep(delay)
-
-        for cookie_name, cookie_value in request.cookies.items():
-            self.driver.add_cookie(
-                {
-                    'name': cookie_name,
-                    'value': cookie_value
-                }
-            )
+        # limit the number of drivers loading pages from the same domain
+        domain = urlsplit(request.url).netloc
+        semaphore = self._domain_semaphores.get(domain)
+        if semaphore is None:
+            semaphore = DeferredSemaphore(self._concurrent_requests_per_domain)
+            self._domain_semaphores[domain] = semaphore
 
-        self.driver.get(request.url)
+        deferred = semaphore.acquire()
+        deferred.addCallback(self._process_in_domain_slot, request)
+        deferred.addBoth(self._release_semaphore, domain, semaphore)
 
-        if request.wait_until:
-            WebDriverWait(self.driver, request.wait_time).until(
-                request.wait_until
-            )
+        return deferred
+
+    def _process_after_download_delay(self, _, request):
+        """Process the request once the download delay has elapsed"""
+
+        delay = self._download_delay
+        if self._randomize_download_delay:
+            delay = random.uniform(*self._download_delay_bounds)
+
+        # wait without blocking the reactor, holding the slot of the domain so
+        # that its requests are spaced by the delay
+        return deferLater(self._reactor, delay, self._process_selenium_request, request)
+
+    def _process_without_download_delay(self, _, request):
+        """Process the request as soon as it has the slot of its domain"""
+
+        return self._process_selenium_request(request)
 
-        if request.screenshot:
-            request.meta['screenshot'] = self.driver.get_screenshot_as_png()
+    def _process_selenium_request(self, request):
+        """Process the request once a driver of the pool is free"""
 
-        if request.script:
-            self.driver.execute_script(request.script)
+        deferred = self._pool.get()
+        deferred.addCallback(self._process_in_thread, request)
 
-        body = str.encode(self.driver.page_source)
+        return deferred
+
+    def _process_in_thread(self, slot, request):
+        """Process the request with the driver of the given pool slot, outside of the reactor"""
+
+        deferred = deferToThreadPool(
+            self._reactor,
+            self._threadpool,
+            self._process_with_driver,
+            request,
+            self._drivers[slot]
+        )
+        deferred.addCallbacks(
+            self._hold_slot,
+            self._release_slot,
+            callbackArgs=(slot,),
+            errbackArgs=(slot,)
+        )
+
+        return deferred
+
+    def _hold_slot(self, response, slot):
+        """Expose the driver of the slot with the response, until it is released"""
+
+        token = object()
+        self._held_slots[slot] = token
+        release_driver = partial(self._release_held_slot, slot, token)
 
         # Expose the driver via the "meta" attribute
-        request.meta.update({'driver': self.driver})
+        response.meta.update({
+            'driver': self._drivers[slot],
+            'release_driver': release_driver,
+        })
+
+        # the slot is released with the response at the latest, the garbage
+        # collector may run in any thread
+        finalizer = weakref.finalize(response, self._reactor.callFromThread, release_driver)
+        finalizer.atexit = False
+
+        return response
+
+    def _release_held_slot(self, slot, token):
+        """Put the slot held by a response back in the pool, if still held by it"""
+
+        if self._held_slots.get(slot) is token:
+            del self._held_slots[slot]
+            self._pool.put(slot)
+
+    def _process_with_driver(self, request, driver):
+        """Process the request with the given driver"""
+
+        self._load_page(request, driver)
+        self._wait(request, driver)
+
+        return self._build_response(request, driver)
+
+    def _load_page(self, request, driver):
+        """Load the page of the request with its cookies"""
+
+        # the page is only loaded again if it is not the current one, the
+        # cookies are only sent on a new page load
+        if request.cookies:
+            self._add_cookies(driver, request)
+        elif (
+            not request.meta.get('selenium_force_reload')
+            and driver.current_url == request.url
+        ):
+            return
+
+        driver.get(request.url)
+
+    def _wait(self, request, driver):
+        """Wait for the condition of the request"""
+
+        if request.wait_until:
+            wait = driver._cached_wait
+            wait._timeout = request.wait_time
+            wait.until(request.wait_until)
+
+    def _build_response(self, request, driver):
+        """Build the response from the page loaded by the driver"""
+
+        if request.screenshot and not request.script:
+            # nothing changes the page in between, both are retrieved at once
+            screenshot = self._executor.submit(driver.get_screenshot_as_png)
+            page_source = driver.page_source
+            request.meta['screenshot'] = screenshot.result()
+        else:
+            if request.screenshot:
+                request.meta['screenshot'] = driver.get_screenshot_as_png()
+
+            if request.script:
+                driver.execute_script(request.script)
+
+            page_source = driver.page_source
+
+        # lone surrogates sent by the driver must not fail the request
+        body = page_source.encode('utf-8', 'replace')
+
+        url = driver.current_url
+        driver._visited_origins.update((_origin(request.url), _origin(url)))
 
         return HtmlResponse(
-            self.driver.current_url,
+            url,
             body=body,
             encoding='utf-8',
             request=request
         )
 
+    def _release_slot(self, result, slot):
+        """Put the slot back in the pool and pass the result through"""
+
+        self._pool.put(slot)
+
+        return result
+
+    @staticmethod
+    def _add_cookies_with_cdp(driver, request):
+        """Add the cookies of the request to the driver with a single devtools command"""
+
+        driver.execute_cdp_cmd(
+            'Network.setCookies',
+            {
+                'cookies': [
+                    {'name': name, 'value': value, 'url': request.url, 'path': '/'}
+                    for name, value in request.cookies.items()
+                ]
+            }
+        )
+
+    @staticmethod
+    def _add_cookies_with_script(driver, request):
+        """Add the cookies of the request to the driver with a single script if possible"""
+
+        # the script sets the cookies of the current page only, which must not
+        # receive the cookies of another origin, and cannot set the cookies
+        # whose name or value would end the cookie string
+        if _origin(driver.current_url) == _origin(request.url) and not any(
+            ';' in f'{name}{value}' or '=' in f'{name}'
+            for name, value in request.cookies.items()
+        ):
+            driver.execute_script(SET_COOKIES_SCRIPT, list(request.cookies.items()))
+            return
+
+        # the cookies are added on a light page of the origin, not on the page
+        # of the request which is then loaded with them
+        driver.get(_origin(request.url) + '/robots.txt')
+        for name, value in request.cookies.items():
+            driver.add_cookie({'name': name, 'value': value, 'path': '/'})
+
+    def _release_semaphore(self, result, domain, semaphore):
+        """Release the domain semaphore and pass the result through"""
+
+        semaphore.release()
+
+        # forget the idle domains, a broad crawl would keep them all otherwise
+        if semaphore.tokens == semaphore.limit and not semaphore.waiting:
+            self._domain_semaphores.pop(domain, None)
+
+        return result
+
+    def _stop_threadpool(self):
+        """Stop the thread pool of the drivers if it is still running"""
+
+        if not self._threadpool.joined:
+            self._threadpool.stop()
+
     def spider_closed(self):
-        """Shutdown the driver when spider is closed"""
+        """Shutdown the drivers of the pool when spider is closed, outside of the reactor
+
+        Returns a ``Deferred`` firing once the drivers are shut down, which scrapy waits for.
+        """
+
+        # a stopped thread pool no longer runs anything
+        if self._threadpool.joined:
+            self._quit_drivers()
+            return succeed(None)
+
+        deferred = DeferredList([
+            deferToThreadPool(self._reactor, self._threadpool, self._quit_driver, slot)
+            for slot in range(self._pool_size)
+        ])
+        deferred.addBoth(self._stop_threads)
+
+        return deferred
+
+    def _quit_drivers(self):
+        """Shutdown every driver of the pool, then the threads they were using"""
+
+        for slot in range(self._pool_size):
+            self._quit_driver(slot)
+
+        self._stop_threads()
+
+    def _stop_threads(self, result=None):
+        """Stop the threads of the drivers and pass the result through"""
+
+        self._stop_threadpool()
+        self._executor.shutdown(wait=False)
+
+        return result
+
+    def _quit_driver(self, slot):
+        """Shutdown the driver of the given pool slot, a failure does not stop the others"""
+
+        driver, self._drivers[slot] = self._drivers[slot], None
+        if driver is None:
+            return
 
-        self.driver.quit()
+        try:
+            driver.quit()
+        except Exception:
+            logger.warning('Could not shutdown the driver of the slot %s', slot, exc_info=True)
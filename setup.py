@@ -2,21 +2,21 @@
 
 from setuptools import setup, find_packages
 
+# lines pointing to git repositories
+GIT_PREFIXES = ('-e git:', '-e git+', 'git:', 'git+')
+EGG_MARK = '#egg='
+
 def get_requirements(source):
     with open(source) as f:
         requirements = f.read().splitlines()
 
     required = []
-    dependency_links = []
     # do not add to required lines pointing to git repositories
-    EGG_MARK = '#egg='
     for line in requirements:
-        if line.startswith('-e git:') or line.startswith('-e git+') or \
-                line.startswith('git:') or line.startswith('git+'):
-            if EGG_MARK in line:
-                package_name = line[line.find(EGG_MARK) + len(EGG_MARK):]
-                required.append(package_name)
-                dependency_links.append(line)
+        if line.startswith(GIT_PREFIXES):
+            egg_index = line.find(EGG_MARK)
+            if egg_index != -1:
+                required.append(line[egg_index + len(EGG_MARK):])
             else:
                 print('Dependency to a git repository should have the format:')
                 print('git+ssh://git@github.com/xxxxx/xxxxxx#egg=package_name')
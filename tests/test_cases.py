@@ -1,9 +1,9 @@
 """This module contains the base test cases for the ``scrapy_selenium`` package"""
 
 from shutil import which
-from unittest import TestCase
 
 import scrapy
+from twisted.trial.unittest import TestCase
 
 
 class BaseScrapySeleniumTestCase(TestCase):
@@ -24,6 +24,9 @@ class BaseScrapySeleniumTestCase(TestCase):
         cls.settings = {
             'SELENIUM_DRIVER_NAME': 'firefox',
             'SELENIUM_DRIVER_EXECUTABLE_PATH': which('geckodriver'),
-            'SELENIUM_DRIVER_ARGUMENTS': ['-headless']
+            'SELENIUM_DRIVER_ARGUMENTS': ['-headless'],
+            'SELENIUM_POOL_SIZE': 1,
+            # show the json documents as text
+            'SELENIUM_DRIVER_PREFERENCES': {'devtools.jsonview.enabled': False},
         }
         cls.spider_klass = cls.SimpleSpider
@@ -1,12 +1,21 @@
 """This module contains the test cases for the middlewares of the ``scrapy_selenium`` package"""
 
-from unittest.mock import patch
+import os
+from unittest.mock import Mock, patch
 
 from scrapy import Request
 from scrapy.crawler import Crawler
+from scrapy.exceptions import NotConfigured
+from twisted.internet import reactor
+from twisted.internet.defer import DeferredSemaphore
+from twisted.internet.task import Clock, deferLater
 
 from scrapy_selenium.http import SeleniumRequest
-from scrapy_selenium.middlewares import SeleniumMiddleware
+from scrapy_selenium.middlewares import (
+    BLOCKED_ASSET_PREFERENCES,
+    BLOCKED_ASSET_URLS,
+    SeleniumMiddleware,
+)
 
 from .test_cases import BaseScrapySeleniumTestCase
 
@@ -33,7 +42,22 @@ class SeleniumMiddlewareTestCase(BaseScrapySeleniumTestCase):
 
         super().tearDownClass()
 
-        cls.selenium_middleware.driver.quit()
+        # the reactor does not run the threads of the drivers anymore
+        cls.selenium_middleware._quit_drivers()
+
+    def _build_middleware(self, **settings):
+        """Build a middleware with the given settings, without starting its drivers"""
+
+        crawler = Crawler(
+            spidercls=self.spider_klass,
+            settings=dict(self.settings, **settings)
+        )
+
+        with patch.object(SeleniumMiddleware, '_build_driver'):
+            selenium_middleware = SeleniumMiddleware.from_crawler(crawler)
+        self.addCleanup(selenium_middleware.spider_closed)
+
+        return selenium_middleware
 
     def test_from_crawler_method_should_initialize_the_driver(self):
         """Test that the ``from_crawler`` method should initialize the selenium driver"""
@@ -44,6 +68,7 @@ class SeleniumMiddlewareTestCase(BaseScrapySeleniumTestCase):
         )
 
         selenium_middleware = SeleniumMiddleware.from_crawler(crawler)
+        self.addCleanup(selenium_middleware.spider_closed)
 
         # The driver must be initialized
         self.assertIsNotNone(selenium_middleware.driver)
@@ -52,8 +77,6 @@ class SeleniumMiddlewareTestCase(BaseScrapySeleniumTestCase):
         selenium_middleware.driver.get('http://www.python.org')
         self.assertIn('Python', selenium_middleware.driver.title)
 
-        selenium_middleware.driver.close()
-
     def test_spider_closed_should_close_the_driver(self):
         """Test that the ``spider_closed`` method should close the driver"""
 
@@ -64,10 +87,74 @@ class SeleniumMiddlewareTestCase(BaseScrapySeleniumTestCase):
 
         selenium_middleware = SeleniumMiddleware.from_crawler(crawler)
 
-        with patch.object(selenium_middleware.driver, 'quit') as mocked_quit:
-            selenium_middleware.spider_closed()
+        driver = selenium_middleware.driver
+        patcher = patch.object(driver, 'quit', wraps=driver.quit)
+        mocked_quit = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        def check_driver(_):
+            mocked_quit.assert_called_once()
+
+        return selenium_middleware.spider_closed().addCallback(check_driver)
+
+    def test_from_crawler_method_should_initialize_a_pool_of_drivers(self):
+        """Test that the ``from_crawler`` method should initialize ``SELENIUM_POOL_SIZE`` drivers"""
+
+        crawler = Crawler(
+            spidercls=self.spider_klass,
+            settings=dict(self.settings, SELENIUM_POOL_SIZE=2)
+        )
+
+        selenium_middleware = SeleniumMiddleware.from_crawler(crawler)
+
+        self.assertEqual(len(selenium_middleware._drivers), 2)
+        self.assertIsNot(*selenium_middleware._drivers)
+
+        # The drivers are still closed for real
+        mocked_quits = []
+        for driver in selenium_middleware._drivers:
+            patcher = patch.object(driver, 'quit', wraps=driver.quit)
+            mocked_quits.append(patcher.start())
+            self.addCleanup(patcher.stop)
+
+        def check_drivers(_):
+            for mocked_quit in mocked_quits:
+                mocked_quit.assert_called_once()
+
+        return selenium_middleware.spider_closed().addCallback(check_drivers)
+
+    def test_from_crawler_method_should_close_the_drivers_of_a_failed_pool(self):
+        """Test that the ``from_crawler`` method should close the drivers if the pool fails"""
+
+        crawler = Crawler(
+            spidercls=self.spider_klass,
+            settings=dict(self.settings, SELENIUM_POOL_SIZE=2)
+        )
+
+        first_driver = Mock()
+        with patch.object(
+            SeleniumMiddleware,
+            '_build_driver',
+            side_effect=[first_driver, RuntimeError('the second driver did not start')]
+        ), self.assertRaises(RuntimeError):
+            SeleniumMiddleware.from_crawler(crawler)
+
+        first_driver.quit.assert_called_once()
+
+    def test_spider_closed_should_close_the_other_drivers_if_one_fails(self):
+        """Test that the ``spider_closed`` method should close every driver and thread"""
+
+        selenium_middleware = self._build_middleware(SELENIUM_POOL_SIZE=2)
 
-        mocked_quit.assert_called_once()
+        first_driver = Mock(**{'quit.side_effect': RuntimeError('the driver is dead')})
+        second_driver = Mock()
+        selenium_middleware._drivers = [first_driver, second_driver]
+
+        def check_drivers(_):
+            second_driver.quit.assert_called_once()
+            self.assertTrue(selenium_middleware._threadpool.joined)
+
+        return selenium_middleware.spider_closed().addCallback(check_drivers)
 
     def test_process_request_should_return_none_if_not_selenium_request(self):
         """Test that the ``process_request`` should return none if not selenium request"""
@@ -86,22 +173,23 @@ class SeleniumMiddlewareTestCase(BaseScrapySeleniumTestCase):
 
         selenium_request = SeleniumRequest(url='http://www.python.org')
 
-        html_response = self.selenium_middleware.process_request(
+        deferred = self.selenium_middleware.process_request(
             request=selenium_request,
             spider=None
         )
 
-        # We have access to the driver on the response via the "meta"
-        self.assertEqual(
-            html_response.meta['driver'],
-            self.selenium_middleware.driver
-        )
+        def check_response(html_response):
+            # The driver is available until it is released
+            self.assertIs(html_response.meta['driver'], self.selenium_middleware.driver)
+            html_response.meta['release_driver']()
 
-        # We also have access to the "selector" attribute on the response
-        self.assertEqual(
-            html_response.selector.xpath('//title/text()').extract_first(),
-            'Welcome to Python.org'
-        )
+            # We also have access to the "selector" attribute on the response
+            self.assertEqual(
+                html_response.selector.xpath('//title/text()').extract_first(),
+                'Welcome to Python.org'
+            )
+
+        return deferred.addCallback(check_response)
 
     def test_process_request_should_return_a_screenshot_if_screenshot_option(self):
         """Test that the ``process_request`` should return a response with a screenshot"""
@@ -111,12 +199,16 @@ class SeleniumMiddlewareTestCase(BaseScrapySeleniumTestCase):
             screenshot=True
         )
 
-        html_response = self.selenium_middleware.process_request(
+        deferred = self.selenium_middleware.process_request(
             request=selenium_request,
             spider=None
         )
 
-        self.assertIsNotNone(html_response.meta['screenshot'])
+        def check_response(html_response):
+            html_response.meta['release_driver']()
+            self.assertIsNotNone(html_response.meta['screenshot'])
+
+        return deferred.addCallback(check_response)
 
     def test_process_request_should_execute_script_if_script_option(self):
         """Test that the ``process_request`` should execute the script and return a response"""
@@ -126,12 +218,426 @@ class SeleniumMiddlewareTestCase(BaseScrapySeleniumTestCase):
             script='document.title = "scrapy_selenium";'
         )
 
-        html_response = self.selenium_middleware.process_request(
+        deferred = self.selenium_middleware.process_request(
+            request=selenium_request,
+            spider=None
+        )
+
+        def check_response(html_response):
+            html_response.meta['release_driver']()
+            self.assertEqual(
+                html_response.selector.xpath('//title/text()').extract_first(),
+                'scrapy_selenium'
+            )
+
+        return deferred.addCallback(check_response)
+
+    def test_process_request_should_limit_the_concurrent_requests_per_domain(self):
+        """Test that the ``process_request`` should wait for a free slot of the domain"""
+
+        selenium_request = SeleniumRequest(url='http://www.python.org')
+
+        # The only slot of the domain is already taken
+        semaphore = DeferredSemaphore(1)
+        semaphore.acquire()
+        self.selenium_middleware._domain_semaphores['www.python.org'] = semaphore
+        self.addCleanup(self.selenium_middleware._domain_semaphores.pop, 'www.python.org', None)
+
+        deferred = self.selenium_middleware.process_request(
+            request=selenium_request,
+            spider=None
+        )
+
+        # The request is pending until a slot of the domain is released
+        self.assertFalse(deferred.called)
+
+        semaphore.release()
+
+        def check_semaphores(html_response):
+            html_response.meta['release_driver']()
+
+            # The domain is forgotten once it has no request being processed
+            self.assertNotIn('www.python.org', self.selenium_middleware._domain_semaphores)
+
+        return deferred.addCallback(check_semaphores)
+
+    def test_process_request_should_send_the_cookies_of_the_request(self):
+        """Test that the ``process_request`` should send the cookies, from any current page"""
+
+        driver = self.selenium_middleware.driver
+        driver.get('about:blank')
+        self.addCleanup(driver.delete_all_cookies)
+
+        # The driver is on another origin, the cookies are added after loading the page
+        deferred = self.selenium_middleware.process_request(
+            request=SeleniumRequest(url='https://httpbin.org/cookies', cookies={'first': '1'}),
+            spider=None
+        )
+
+        def process_same_origin_request(html_response):
+            html_response.meta['release_driver']()
+            self.assertIn('"first": "1"', html_response.text)
+
+            # The driver is on the same origin, the cookies are added with a script
+            return self.selenium_middleware.process_request(
+                request=SeleniumRequest(
+                    url='https://httpbin.org/cookies',
+                    cookies={'second': 'ab+/=='}
+                ),
+                spider=None
+            )
+
+        def check_response(html_response):
+            html_response.meta['release_driver']()
+            self.assertIn('"first": "1"', html_response.text)
+            # The value is sent unchanged, as with the other ways of adding cookies
+            self.assertIn('"second": "ab+/=="', html_response.text)
+
+        deferred.addCallback(process_same_origin_request)
+
+        return deferred.addCallback(check_response)
+
+    def test_process_request_should_hold_the_driver_until_it_is_released(self):
+        """Test that the driver should not go back to the pool before it is released"""
+
+        deferred = self.selenium_middleware.process_request(
+            request=SeleniumRequest(url='http://www.python.org'),
+            spider=None
+        )
+
+        def check_pool(html_response):
+            self.assertNotIn(0, self.selenium_middleware._pool.pending)
+
+            html_response.meta['release_driver']()
+            self.assertIn(0, self.selenium_middleware._pool.pending)
+
+            # Releasing the driver again has no effect
+            html_response.meta['release_driver']()
+            self.assertEqual(self.selenium_middleware._pool.pending.count(0), 1)
+
+        return deferred.addCallback(check_pool)
+
+    def test_process_request_should_release_the_driver_with_the_response(self):
+        """Test that the driver should go back to the pool once the response is collected"""
+
+        deferred = self.selenium_middleware.process_request(
+            request=SeleniumRequest(url='http://www.python.org'),
+            spider=None
+        )
+        # The response is only referenced by the deferred, it is collected right away
+        deferred.addCallback(lambda _: None)
+
+        def check_pool(_):
+            self.assertIn(0, self.selenium_middleware._pool.pending)
+
+        # The slot is released from the reactor thread
+        deferred.addCallback(lambda _: deferLater(reactor, 0, check_pool, None))
+
+        return deferred
+
+    def test_add_cookies_with_script_should_not_load_the_page_of_another_origin(self):
+        """Test that the ``_add_cookies_with_script`` method should add the cookies on a light page"""
+
+        driver = Mock(current_url='about:blank')
+
+        SeleniumMiddleware._add_cookies_with_script(
+            driver,
+            SeleniumRequest(url='https://httpbin.org/cookies', cookies={'first': '1'})
+        )
+
+        driver.get.assert_called_once_with('https://httpbin.org/robots.txt')
+        driver.add_cookie.assert_called_once_with({'name': 'first', 'value': '1', 'path': '/'})
+
+    def test_soft_reset_should_clear_the_driver_without_restarting_it(self):
+        """Test that the ``soft_reset`` method should only clear the state of the driver"""
+
+        driver = self.selenium_middleware.driver
+        driver.get('http://www.python.org')
+
+        patcher = patch.object(driver, 'quit')
+        mocked_quit = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.assertIs(driver.replace_driver(), driver)
+
+        mocked_quit.assert_not_called()
+        self.assertEqual(driver.current_url, 'about:blank')
+        self.assertEqual(driver.get_cookies(), [])
+
+        # The idle driver is back in the pool
+        self.assertIn(0, self.selenium_middleware._pool.pending)
+
+    def test_soft_reset_should_reject_a_driver_processing_a_request(self):
+        """Test that the ``soft_reset`` method should not reset a driver processing a request"""
+
+        # The only slot of the pool is checked out
+        self.selenium_middleware._pool.get()
+        self.addCleanup(self.selenium_middleware._release_slot, None, 0)
+
+        with self.assertRaises(RuntimeError):
+            self.selenium_middleware.soft_reset(0)
+
+    def test_process_request_should_not_load_the_current_page_again(self):
+        """Test that the ``process_request`` should not load the page the driver is already on"""
+
+        driver = self.selenium_middleware.driver
+        driver.get('http://www.python.org')
+
+        selenium_request = SeleniumRequest(url=driver.current_url)
+
+        patcher = patch.object(driver, 'get')
+        mocked_get = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        deferred = self.selenium_middleware.process_request(
             request=selenium_request,
             spider=None
         )
 
+        def check_response(html_response):
+            html_response.meta['release_driver']()
+            mocked_get.assert_not_called()
+
+        return deferred.addCallback(check_response)
+
+    def test_process_request_should_space_the_requests_of_a_domain_by_the_download_delay(self):
+        """Test that the ``process_request`` should wait the download delay in the domain slot"""
+
+        clock = Clock()
+        processed_at = []
+
+        def process_selenium_request(request):
+            processed_at.append(clock.seconds())
+
+        with patch.multiple(
+            self.selenium_middleware,
+            _reactor=clock,
+            _download_delay=2,
+            _randomize_download_delay=False,
+            _process_in_domain_slot=self.selenium_middleware._process_after_download_delay,
+            _concurrent_requests_per_domain=1,
+            _process_selenium_request=process_selenium_request,
+        ):
+            for _ in range(3):
+                self.selenium_middleware.process_request(
+                    request=SeleniumRequest(url='http://www.example.com'),
+                    spider=None
+                )
+
+            # The requests wait for each other instead of all firing after the delay
+            clock.advance(2)
+            self.assertEqual(processed_at, [2])
+
+            clock.pump([2, 2])
+            self.assertEqual(processed_at, [2, 4, 6])
+
+    def test_from_crawler_method_should_skip_the_download_delay_if_not_set(self):
+        """Test that the ``from_crawler`` method should only wait for a download delay if set"""
+
+        selenium_middleware = self._build_middleware(DOWNLOAD_DELAY=0)
+        self.assertEqual(
+            selenium_middleware._process_in_domain_slot,
+            selenium_middleware._process_without_download_delay
+        )
+
+        selenium_middleware = self._build_middleware(DOWNLOAD_DELAY=2)
+        self.assertEqual(
+            selenium_middleware._process_in_domain_slot,
+            selenium_middleware._process_after_download_delay
+        )
+
+    def test_from_crawler_method_should_set_the_page_load_strategy(self):
+        """Test that the ``from_crawler`` method should set the page load strategy capability"""
+
+        self.assertEqual(self.selenium_middleware._capabilities['pageLoadStrategy'], 'eager')
+
+        crawler = Crawler(
+            spidercls=self.spider_klass,
+            settings=dict(self.settings, SELENIUM_PAGE_LOAD_STRATEGY='normal')
+        )
+
+        selenium_middleware = SeleniumMiddleware.from_crawler(crawler)
+        self.addCleanup(selenium_middleware.spider_closed)
+
+        self.assertEqual(selenium_middleware._capabilities['pageLoadStrategy'], 'normal')
+
+    def test_from_crawler_method_should_reject_an_unknown_page_load_strategy(self):
+        """Test that the ``from_crawler`` method should reject an unknown page load strategy"""
+
+        crawler = Crawler(
+            spidercls=self.spider_klass,
+            settings=dict(self.settings, SELENIUM_PAGE_LOAD_STRATEGY='fast')
+        )
+
+        with self.assertRaises(NotConfigured):
+            SeleniumMiddleware.from_crawler(crawler)
+
+    def test_from_crawler_method_should_initialize_the_remote_drivers(self):
+        """Test that the ``from_crawler`` method should build the remote drivers with the options"""
+
+        crawler = Crawler(
+            spidercls=self.spider_klass,
+            settings=dict(
+                self.settings,
+                SELENIUM_DRIVER_EXECUTABLE_PATH=None,
+                SELENIUM_COMMAND_EXECUTOR='http://localhost:4444/wd/hub',
+                SELENIUM_DRIVER_PREFERENCES={'intl.accept_languages': 'fr'},
+                SELENIUM_PAGE_LOAD_STRATEGY='none',
+            )
+        )
+
+        with patch('selenium.webdriver.Remote') as mocked_remote:
+            selenium_middleware = SeleniumMiddleware.from_crawler(crawler)
+        self.addCleanup(selenium_middleware.spider_closed)
+
+        mocked_remote.assert_called_once_with(
+            command_executor='http://localhost:4444/wd/hub',
+            desired_capabilities=selenium_middleware._capabilities
+        )
+
+        capabilities = selenium_middleware._capabilities
+        self.assertEqual(capabilities['pageLoadStrategy'], 'none')
+        self.assertEqual(
+            capabilities['moz:firefoxOptions']['prefs']['intl.accept_languages'],
+            'fr'
+        )
+
+    def test_persistent_profile_kwargs_should_use_a_chrome_profile_per_slot(self):
+        """Test that the ``_persistent_profile_kwargs`` method should use a directory per slot"""
+
+        user_data_dir = self.mktemp()
+        selenium_middleware = self._build_middleware(
+            SELENIUM_DRIVER_NAME='chrome',
+            SELENIUM_DRIVER_EXECUTABLE_PATH='chromedriver',
+            SELENIUM_DRIVER_ARGUMENTS=['--headless'],
+            SELENIUM_USER_DATA_DIR=user_data_dir,
+        )
+
+        driver_kwargs = selenium_middleware._persistent_profile_kwargs(1)
+
+        profile_dir = os.path.join(user_data_dir, '1')
+        self.assertTrue(os.path.isdir(profile_dir))
+        self.assertEqual(
+            driver_kwargs['chrome_options'].arguments,
+            [
+                '--headless',
+                f'--user-data-dir={profile_dir}',
+                f'--disk-cache-dir={os.path.join(profile_dir, "cache")}',
+            ]
+        )
+
+        # The options shared by the slots are left untouched
+        self.assertEqual(
+            selenium_middleware._driver_kwargs['chrome_options'].arguments,
+            ['--headless']
+        )
+
+    def test_persistent_profile_kwargs_should_use_a_firefox_profile_per_slot(self):
+        """Test that the ``_persistent_profile_kwargs`` method should use a directory per slot"""
+
+        user_data_dir = self.mktemp()
+        selenium_middleware = self._build_middleware(SELENIUM_USER_DATA_DIR=user_data_dir)
+
+        driver_kwargs = selenium_middleware._persistent_profile_kwargs(1)
+
+        profile_dir = os.path.join(user_data_dir, '1')
+        self.assertTrue(os.path.isdir(profile_dir))
         self.assertEqual(
-            html_response.selector.xpath('//title/text()').extract_first(),
-            'scrapy_selenium'
+            driver_kwargs['firefox_options'].arguments,
+            ['-headless', '-profile', profile_dir]
+        )
+        self.assertTrue(
+            selenium_middleware._capabilities['moz:firefoxOptions']['prefs']
+            ['browser.cache.disk.enable']
+        )
+
+    def test_from_crawler_method_should_reject_a_persistent_and_a_cloned_profile(self):
+        """Test that the ``from_crawler`` method should reject two kinds of profiles at once"""
+
+        crawler = Crawler(
+            spidercls=self.spider_klass,
+            settings=dict(
+                self.settings,
+                SELENIUM_USER_DATA_DIR=self.mktemp(),
+                SELENIUM_DRIVER_PROFILE=self.mktemp(),
+            )
+        )
+
+        with self.assertRaises(NotConfigured):
+            SeleniumMiddleware.from_crawler(crawler)
+
+    def test_from_crawler_method_should_block_the_firefox_assets(self):
+        """Test that the ``from_crawler`` method should set the preferences blocking the assets"""
+
+        selenium_middleware = self._build_middleware(SELENIUM_BLOCK_ASSETS=True)
+
+        preferences = selenium_middleware._capabilities['moz:firefoxOptions']['prefs']
+        for name, value in BLOCKED_ASSET_PREFERENCES.items():
+            self.assertEqual(preferences[name], value)
+
+    def test_build_driver_should_block_the_chrome_assets(self):
+        """Test that the ``_build_driver`` method should block the assets of the chrome driver"""
+
+        selenium_middleware = self._build_middleware(
+            SELENIUM_DRIVER_NAME='chrome',
+            SELENIUM_DRIVER_EXECUTABLE_PATH='chromedriver',
+            SELENIUM_DRIVER_ARGUMENTS=['--headless'],
+            SELENIUM_BLOCK_ASSETS=True,
+        )
+
+        with patch.object(selenium_middleware, '_driver_klass'):
+            driver = selenium_middleware._build_driver(0)
+
+        driver.execute_cdp_cmd.assert_any_call('Network.enable', {})
+        driver.execute_cdp_cmd.assert_any_call(
+            'Network.setBlockedURLs',
+            {'urls': BLOCKED_ASSET_URLS}
+        )
+
+    def test_build_driver_should_override_the_chrome_viewport(self):
+        """Test that the ``_build_driver`` method should set the chrome viewport with devtools"""
+
+        selenium_middleware = self._build_middleware(
+            SELENIUM_DRIVER_NAME='chrome',
+            SELENIUM_DRIVER_EXECUTABLE_PATH='chromedriver',
+            SELENIUM_DRIVER_ARGUMENTS=['--headless'],
+        )
+
+        with patch.object(selenium_middleware, '_driver_klass'), \
+                patch('scrapy_selenium.middlewares.random') as mocked_random:
+            mocked_random.uniform.side_effect = [1280.5, 720.5]
+            driver = selenium_middleware._build_driver(0)
+
+        driver.execute_cdp_cmd.assert_called_once_with(
+            'Emulation.setDeviceMetricsOverride',
+            {'width': 1280, 'height': 720, 'deviceScaleFactor': 1, 'mobile': False}
+        )
+        driver.set_window_size.assert_not_called()
+
+    def test_build_driver_should_resize_the_firefox_window(self):
+        """Test that the ``_build_driver`` method should resize the window of the other drivers"""
+
+        selenium_middleware = self._build_middleware()
+
+        with patch.object(selenium_middleware, '_driver_klass'), \
+                patch('scrapy_selenium.middlewares.random') as mocked_random:
+            mocked_random.uniform.side_effect = [1280.5, 720.5]
+            driver = selenium_middleware._build_driver(0)
+
+        driver.set_window_size.assert_called_once_with(1280, 720)
+        driver.execute_cdp_cmd.assert_not_called()
+
+    def test_build_response_should_replace_the_invalid_characters(self):
+        """Test that the ``_build_response`` method should not fail on a lone surrogate"""
+
+        driver = Mock(
+            page_source='<html><body>\ud800</body></html>',
+            current_url='http://www.python.org/'
         )
+
+        html_response = self.selenium_middleware._build_response(
+            SeleniumRequest(url='http://www.python.org/'),
+            driver
+        )
+
+        self.assertEqual(html_response.body, b'<html><body>?</body></html>')